@@ -6,17 +6,40 @@ GPX Waypoint Deduplication Script
 - Renames waypoints for Lowrance fish finder compatibility
 """
 
-import xml.etree.ElementTree as ET
-from math import radians, cos, sin, asin, sqrt
+import re
+import sys
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress
+from math import cos, sin, asin, sqrt, floor
 from pathlib import Path
 from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+# Optional accelerators; each has a pure-Python fallback
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+try:
+    import ahocorasick
+except ImportError:  # reef type matching falls back to a regex
+    ahocorasick = None
 
 # Constants
+EARTH_RADIUS_M = 6371000  # meters
+DEG_TO_RAD = 0.017453292519943295  # pi / 180
 DUPLICATE_RADIUS_M = 10  # meters
 LON_BOUNDARY = 127.5  # longitude boundary between west and east
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024  # below this total input size, worker start-up costs more than it saves
+GRID_NEIGHBORS = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]  # 3x3 cell offsets
+MIN_CELL_M = 1.0  # smallest grid cell, so a zero or negative radius still hashes exact duplicates together
 
 # GPX namespace
 NS = {'gpx': 'http://www.topografix.com/GPX/1/1'}
+GPX_TAG = '{%s}' % NS['gpx']  # namespace prefix of qualified tag names
 
 # Reef type abbreviation mapping (어초 약어 매핑)
 REEF_ABBREV = {
@@ -99,120 +122,193 @@ REEF_ABBREV = {
     '추가': '',
 }
 
-def haversine(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points in meters using Haversine formula"""
-    R = 6371000  # Earth radius in meters
-
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-
-    return R * c
+# Reef types with a non-empty abbreviation, longest first; the first one found in a text wins
+_REEF_KEYS = sorted((k for k, v in REEF_ABBREV.items() if v), key=len, reverse=True)
+_REEF_RANK = {k: i for i, k in enumerate(_REEF_KEYS)}
+_REEF_ABBREVS = tuple(REEF_ABBREV[k] for k in _REEF_KEYS)  # abbreviation by rank
+# Zero-width lookahead so every start position is tried, including overlapping matches
+_REEF_RE = re.compile('(?=(%s))' % '|'.join(map(re.escape, _REEF_KEYS)))
+
+if ahocorasick is not None:
+    # One linear pass per text regardless of how many reef types there are
+    _REEF_AUTOMATON = ahocorasick.Automaton()
+    for _rank, _key in enumerate(_REEF_KEYS):
+        _REEF_AUTOMATON.add_word(_key, _rank)
+    _REEF_AUTOMATON.make_automaton()
+else:
+    _REEF_AUTOMATON = None
+
+def haversine_fast(points, i, j):
+    """Haversine distance in meters between points i and j, using their cached radians and cos(lat)"""
+    latr = points.latr
+    lonr = points.lonr
+    dlat = latr[j] - latr[i]
+    dlon = lonr[j] - lonr[i]
+
+    h = sin(dlat * 0.5)**2 + points.coslat[i] * points.coslat[j] * sin(dlon * 0.5)**2
+
+    return 2 * EARTH_RADIUS_M * asin(sqrt(h))
+
+class WaypointArrays:
+    """
+    Waypoints stored as parallel columns (struct of arrays)
+    Coordinates are packed float64 arrays, text fields are plain lists.
+    Index i across all columns is one waypoint.
+    """
+    __slots__ = ('lats', 'lons', 'latr', 'lonr', 'coslat',
+                 'original_names', 'descs', 'cmts', 'syms', 'source_types')
+
+    def __init__(self):
+        self.lats = array('d')
+        self.lons = array('d')
+        # Cached for haversine_fast
+        self.latr = array('d')
+        self.lonr = array('d')
+        self.coslat = array('d')
+        self.original_names = []
+        self.descs = []
+        self.cmts = []
+        self.syms = []
+        self.source_types = []
+
+    def __len__(self):
+        return len(self.lats)
+
+    def append(self, lat, lon, original_name, desc, cmt, sym, source_type):
+        lat_r = lat * DEG_TO_RAD
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.latr.append(lat_r)
+        self.lonr.append(lon * DEG_TO_RAD)
+        self.coslat.append(cos(lat_r))
+        self.original_names.append(original_name)
+        self.descs.append(desc)
+        self.cmts.append(cmt)
+        self.syms.append(sym)
+        self.source_types.append(source_type)
+
+    def extend(self, other):
+        for column in self.__slots__:
+            getattr(self, column).extend(getattr(other, column))
+
+    def select(self, mask):
+        """Return a new WaypointArrays with only the waypoints where mask is true"""
+        selected = WaypointArrays()
+        for column in self.__slots__:
+            getattr(selected, column).extend(compress(getattr(self, column), mask))
+        return selected
 
 def extract_reef_type(name, desc=''):
     """Extract and abbreviate reef type from waypoint name or description"""
     # Try name first, then desc
-    for text in [name, desc]:
+    for text in (name, desc):
         if not text:
             continue
 
         # Try to find matching reef type (longer patterns first for better matching)
-        sorted_items = sorted(REEF_ABBREV.items(), key=lambda x: -len(x[0]))
-        for full_name, abbrev in sorted_items:
-            if full_name in text:
-                if abbrev:  # Skip empty abbreviations (보강, 추가 등)
-                    return abbrev
+        if _REEF_AUTOMATON is not None:
+            rank = min((rank for _, rank in _REEF_AUTOMATON.iter(text)), default=None)
+        else:
+            rank = min((_REEF_RANK[m.group(1)] for m in _REEF_RE.finditer(text)), default=None)
+        if rank is not None:
+            return _REEF_ABBREVS[rank]
 
     return None
 
+def _child_text(fields, name, default):
+    """Text of the first <name> child (namespaced tag preferred), or default if there is none"""
+    for tag in (GPX_TAG + name, name):
+        if tag in fields:
+            return fields[tag]
+    return default
+
 def parse_waypoints(gpx_file, source_type='reef'):
     """
-    Parse waypoints from GPX file
+    Parse waypoints from GPX file into a WaypointArrays
     source_type: 'reef' (어초), 'other' (다른사람), 'own' (개인)
     """
-    waypoints = []
+    waypoints = WaypointArrays()
+    source_type = sys.intern(source_type)
+    wpt_tags = (GPX_TAG + 'wpt', 'wpt')  # with or without namespace
     try:
-        tree = ET.parse(gpx_file)
-        root = tree.getroot()
+        # Stream the file: handle each <wpt> once it is complete, then clear it
+        for _, wpt in ET.iterparse(str(gpx_file), events=('end',)):
+            if wpt.tag not in wpt_tags:
+                continue
 
-        # Handle namespace
-        wpt_elements = root.findall('.//gpx:wpt', NS)
-        if not wpt_elements:
-            wpt_elements = root.findall('.//wpt')
-
-        for wpt in wpt_elements:
             lat = float(wpt.get('lat'))
             lon = float(wpt.get('lon'))
 
-            name = wpt.find('gpx:name', NS)
-            if name is None:
-                name = wpt.find('name')
-
-            desc = wpt.find('gpx:desc', NS)
-            if desc is None:
-                desc = wpt.find('desc')
-
-            cmt = wpt.find('gpx:cmt', NS)
-            if cmt is None:
-                cmt = wpt.find('cmt')
-
-            sym = wpt.find('gpx:sym', NS)
-            if sym is None:
-                sym = wpt.find('sym')
-
-            name_text = name.text if name is not None else ''
-            desc_text = desc.text if desc is not None else ''
-
-            waypoints.append({
-                'lat': lat,
-                'lon': lon,
-                'original_name': name_text or desc_text,
-                'desc': desc_text,
-                'cmt': cmt.text if cmt is not None else '',
-                'sym': sym.text if sym is not None else 'Fish',
-                'source_type': source_type
-            })
+            # One pass over the children instead of a find() per field
+            fields = {}
+            for child in wpt:
+                fields.setdefault(child.tag, child.text)
+
+            name_text = _child_text(fields, 'name', '')
+            desc_text = _child_text(fields, 'desc', '')
+            # Only a handful of distinct symbols; share one object per value
+            sym = _child_text(fields, 'sym', 'Fish')
+            if sym:
+                sym = sys.intern(sym)
+
+            waypoints.append(
+                lat, lon,
+                original_name=name_text or desc_text,
+                desc=desc_text,
+                cmt=_child_text(fields, 'cmt', ''),
+                sym=sym,
+                source_type=source_type
+            )
+            wpt.clear()
 
     except Exception as e:
         print(f"Error parsing {gpx_file}: {e}")
 
     return waypoints
 
-def remove_duplicates(waypoints, radius_m=DUPLICATE_RADIUS_M):
-    """Remove duplicate waypoints within specified radius"""
-    if not waypoints:
-        return []
-
-    unique = []
-    for wpt in waypoints:
-        is_duplicate = False
-        for existing in unique:
-            dist = haversine(wpt['lat'], wpt['lon'], existing['lat'], existing['lon'])
-            if dist <= radius_m:
-                is_duplicate = True
-                break
-        if not is_duplicate:
-            unique.append(wpt)
-
-    return unique
-
-def generate_short_names(waypoints):
-    """Generate short names for waypoints based on source type and reef type"""
-    # Group by naming category
-    counters = {}  # {'reef_type': count, 'own': count, 'oth': count}
+def grid_cells(points, radius_m):
+    """
+    (row, col) cell of every point on a uniform lat/lon grid, sized so that
+    any two points within radius_m fall in the same or adjacent cells
+    """
+    # |dlat| never exceeds r/R; the longitude span of r is widest at the
+    # highest latitude present (smallest cos(lat))
+    cell_lat = max(radius_m, MIN_CELL_M) / EARTH_RADIUS_M
+    cell_lon = 2 * asin(min(1.0, sin(cell_lat / 2) / min(points.coslat, default=1.0)))
+    return [(floor(lat_r / cell_lat), floor(lon_r / cell_lon)) for lat_r, lon_r in zip(points.latr, points.lonr)]
 
-    for wpt in waypoints:
-        source_type = wpt['source_type']
+def remove_duplicates(points, radius_m=DUPLICATE_RADIUS_M):
+    """
+    Find duplicate waypoints within specified radius
+    Returns a keep mask over points: the first of each group of duplicates is kept
+    """
+    # Uniform grid hashing: kept points are bucketed by grid cell and each
+    # point is compared only with kept points in the 3x3 surrounding cells
+    buckets = {}  # {(row, col): [kept point indices]}
+    keep = [False] * len(points)
+    for i, (row, col) in enumerate(grid_cells(points, radius_m)):
+        candidates = (j for dr, dc in GRID_NEIGHBORS for j in buckets.get((row + dr, col + dc), ()))
+        if not any(haversine_fast(points, i, j) <= radius_m for j in candidates):
+            buckets.setdefault((row, col), []).append(i)
+            keep[i] = True
+
+    return keep
+
+def generate_short_names(points):
+    """
+    Generate short names for waypoints based on source type and reef type
+    Yields (prefix, short_name) for each waypoint in order
+    """
+    # Group by naming category
+    counters = Counter()  # {'reef_type': count, 'own': count, 'oth': count}
 
+    for source_type, original_name, desc in zip(points.source_types, points.original_names, points.descs):
         if source_type == 'own':
             prefix = 'own'
         elif source_type == 'other':
             prefix = 'oth'
         else:  # reef
-            reef_type = extract_reef_type(wpt['original_name'], wpt.get('desc', ''))
+            reef_type = extract_reef_type(original_name, desc)
             if reef_type:
                 prefix = reef_type
             else:
@@ -220,17 +316,17 @@ def generate_short_names(waypoints):
                 prefix = '어초'
 
         # Increment counter
-        if prefix not in counters:
-            counters[prefix] = 0
         counters[prefix] += 1
 
         # Generate short name
-        wpt['short_name'] = f"{prefix}_{counters[prefix]:03d}"
-
-    return waypoints
+        yield prefix, f"{prefix}_{counters[prefix]:03d}"
 
-def write_gpx(waypoints, output_file, region_name):
-    """Write waypoints to GPX file (Lowrance compatible)"""
+def write_gpx(points, short_names, output_file, region_name):
+    """
+    Write waypoints to GPX file (Lowrance compatible)
+    short_names: (prefix, short_name) pairs as yielded by generate_short_names
+    Returns a Counter of waypoints per name prefix
+    """
     gpx_header = f'''<?xml version="1.0" encoding="UTF-8"?>
 <gpx version="1.1" creator="Fishing Points Deduplicator"
      xmlns="http://www.topografix.com/GPX/1/1">
@@ -243,23 +339,26 @@ def write_gpx(waypoints, output_file, region_name):
 
     gpx_footer = '</gpx>'
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(gpx_header)
-
-        for wpt in waypoints:
-            name = wpt['short_name']
-            # Store original name in desc for reference
-            original = wpt['original_name'] or ''
-            original = original.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    # Build the whole document in memory and write it once
+    parts = [gpx_header]
+    append = parts.append
+    prefix_counts = Counter()
+    for lat, lon, (prefix, name), original, sym in zip(points.lats, points.lons, short_names,
+                                                       points.original_names, points.syms):
+        prefix_counts[prefix] += 1
+        # Store original name in desc for reference
+        desc = f'    <desc>{escape(original)}</desc>\n' if original else ''
+        append(f'  <wpt lat="{lat:.9f}" lon="{lon:.9f}">\n'
+               f'    <name>{name}</name>\n'
+               f'{desc}'
+               f'    <sym>{sym}</sym>\n'
+               '  </wpt>\n')
+    append(gpx_footer)
 
-            f.write(f'  <wpt lat="{wpt["lat"]:.9f}" lon="{wpt["lon"]:.9f}">\n')
-            f.write(f'    <name>{name}</name>\n')
-            if original:
-                f.write(f'    <desc>{original}</desc>\n')
-            f.write(f'    <sym>{wpt["sym"]}</sym>\n')
-            f.write('  </wpt>\n')
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(''.join(parts))
 
-        f.write(gpx_footer)
+    return prefix_counts
 
 def main():
     base_dir = Path(__file__).parent.parent
@@ -285,36 +384,49 @@ def main():
 
     my_own_file = gpx_dir / 'my_own_points.gpx'
 
+    # Parse all source files; only large inputs are spread over worker processes
+    source_types = {f: 'reef' for f in west_reef_files + east_reef_files}
+    source_types.update({f: 'other' for f in west_other_files})
+    source_types[my_own_file] = 'own'
+    files = [f for f in source_types if f.exists()]
+    types = [source_types[f] for f in files]
+    if len(files) > 1 and sum(f.stat().st_size for f in files) >= PARALLEL_MIN_BYTES:
+        with ProcessPoolExecutor() as executor:
+            parsed = dict(zip(files, executor.map(parse_waypoints, files, types)))
+    else:
+        parsed = dict(zip(files, map(parse_waypoints, files, types)))
+
     # Collect waypoints
-    west_points = []
-    east_points = []
+    west_points = WaypointArrays()
+    east_points = WaypointArrays()
 
-    # Parse west reef files
+    # Add west reef files
     for f in west_reef_files:
-        if f.exists():
-            points = parse_waypoints(f, source_type='reef')
+        if f in parsed:
+            points = parsed[f]
             west_points.extend(points)
             print(f"West reef - {f.name}: {len(points)} points")
 
-    # Parse west other files
+    # Add west other files
     for f in west_other_files:
-        if f.exists():
-            points = parse_waypoints(f, source_type='other')
+        if f in parsed:
+            points = parsed[f]
             west_points.extend(points)
             print(f"West other - {f.name}: {len(points)} points")
 
-    # Parse east reef files
+    # Add east reef files
     for f in east_reef_files:
-        if f.exists():
-            points = parse_waypoints(f, source_type='reef')
+        if f in parsed:
+            points = parsed[f]
             east_points.extend(points)
             print(f"East reef - {f.name}: {len(points)} points")
 
-    # Parse my_own_points and classify by longitude
-    if my_own_file.exists():
-        my_points = parse_waypoints(my_own_file, source_type='own')
-        my_west = [p for p in my_points if p['lon'] < LON_BOUNDARY]
-        my_east = [p for p in my_points if p['lon'] >= LON_BOUNDARY]
+    # Classify my_own_points by longitude
+    if my_own_file in parsed:
+        my_points = parsed[my_own_file]
+        is_west = [lon < LON_BOUNDARY for lon in my_points.lons]
+        my_west = my_points.select(is_west)
+        my_east = my_points.select([not west for west in is_west])
         west_points.extend(my_west)
         east_points.extend(my_east)
         print(f"My own points - West: {len(my_west)}, East: {len(my_east)}")
@@ -324,41 +436,29 @@ def main():
     print(f"  East total: {len(east_points)}")
 
     # Remove duplicates
-    west_unique = remove_duplicates(west_points)
-    east_unique = remove_duplicates(east_points)
+    west_unique = west_points.select(remove_duplicates(west_points))
+    east_unique = east_points.select(remove_duplicates(east_points))
 
     print(f"\nAfter deduplication (10m radius):")
     print(f"  West: {len(west_points)} -> {len(west_unique)} ({len(west_points) - len(west_unique)} removed)")
     print(f"  East: {len(east_points)} -> {len(east_unique)} ({len(east_points) - len(east_unique)} removed)")
 
-    # Generate short names
-    west_unique = generate_short_names(west_unique)
-    east_unique = generate_short_names(east_unique)
+    # Generate short names while writing result files (single pass per region)
+    west_output = result_dir / 'west_result.gpx'
+    east_output = result_dir / 'east_result.gpx'
+
+    west_prefixes = write_gpx(west_unique, generate_short_names(west_unique), west_output, 'West Sea (서해)')
+    east_prefixes = write_gpx(east_unique, generate_short_names(east_unique), east_output, 'East Sea (동해)')
 
     # Print naming summary
     print(f"\nNaming summary (West):")
-    west_prefixes = {}
-    for wpt in west_unique:
-        prefix = wpt['short_name'].rsplit('_', 1)[0]
-        west_prefixes[prefix] = west_prefixes.get(prefix, 0) + 1
-    for prefix, count in sorted(west_prefixes.items(), key=lambda x: -x[1])[:10]:
+    for prefix, count in west_prefixes.most_common(10):
         print(f"  {prefix}: {count}")
 
     print(f"\nNaming summary (East):")
-    east_prefixes = {}
-    for wpt in east_unique:
-        prefix = wpt['short_name'].rsplit('_', 1)[0]
-        east_prefixes[prefix] = east_prefixes.get(prefix, 0) + 1
-    for prefix, count in sorted(east_prefixes.items(), key=lambda x: -x[1])[:10]:
+    for prefix, count in east_prefixes.most_common(10):
         print(f"  {prefix}: {count}")
 
-    # Write result files
-    west_output = result_dir / 'west_result.gpx'
-    east_output = result_dir / 'east_result.gpx'
-
-    write_gpx(west_unique, west_output, 'West Sea (서해)')
-    write_gpx(east_unique, east_output, 'East Sea (동해)')
-
     print(f"\nOutput files:")
     print(f"  {west_output}")
     print(f"  {east_output}")
@@ -6,43 +6,52 @@ GPX 파일 관리 유틸리티
 - 통계 출력
 """
 
-import xml.etree.ElementTree as ET
-import pandas as pd
+import numpy as np
+import csv
 import json
 import os
 import sys
-from math import radians, sin, cos, sqrt, atan2
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
-GPX_NS = {'gpx': 'http://www.topografix.com/GPX/1/1'}
+# lxml이 있으면 C로 구현된 파서와 find() 사용 (선택 사항)
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
+# orjson이 있으면 JSON 내보내기에 사용 (선택 사항)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """두 좌표 사이의 거리 계산 (미터)"""
-    R = 6371000  # 지구 반경 (미터)
-    
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    
-    return R * c
+GPX_NS = {'gpx': 'http://www.topografix.com/GPX/1/1'}
+EARTH_RADIUS_M = 6371000  # 지구 반경 (미터)
+GRID_NEIGHBORS = [(dr, dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)]  # 주변 3x3 셀
+MIN_CELL_M = 1.0  # 격자 셀 최소 크기 (거리 임계값 0 이하에서도 0으로 나누지 않도록)
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024  # 전체 입력이 이보다 작으면 단일 프로세스로 파싱
 
 
-def parse_gpx(gpx_path):
-    """GPX 파일 파싱하여 waypoint 리스트 반환"""
-    tree = ET.parse(gpx_path)
-    root = tree.getroot()
+def iter_gpx(gpx_path):
+    """GPX 파일을 스트리밍 파싱하여 waypoint를 하나씩 반환 (파일 전체 DOM을 만들지 않음)"""
+    wpt_tag = '{%s}wpt' % GPX_NS['gpx']
+    # 모든 waypoint가 하나의 파일명 문자열 객체를 공유 (Counter 등에서 비교 비용 감소)
+    source_file = sys.intern(os.path.basename(gpx_path))
     
-    waypoints = []
-    for wpt in root.findall('.//gpx:wpt', GPX_NS):
+    for _, wpt in ET.iterparse(str(gpx_path), events=('end',)):
+        if wpt.tag != wpt_tag:
+            continue
+        
         lat = float(wpt.get('lat'))
         lon = float(wpt.get('lon'))
         
-        name_elem = wpt.find('gpx:name', GPX_NS) or wpt.find('gpx:n', GPX_NS)
+        # Element의 진리값은 자식 유무라서 `or`로 이으면 자식 없는 <name>이 무시됨
+        name_elem = wpt.find('gpx:name', GPX_NS)
+        if name_elem is None:
+            name_elem = wpt.find('gpx:n', GPX_NS)
         name = name_elem.text if name_elem is not None and name_elem.text else ''
         
         desc_elem = wpt.find('gpx:desc', GPX_NS)
@@ -55,9 +64,9 @@ def parse_gpx(gpx_path):
         time = time_elem.text if time_elem is not None and time_elem.text else ''
         
         sym_elem = wpt.find('gpx:sym', GPX_NS)
-        sym = sym_elem.text if sym_elem is not None and sym_elem.text else ''
+        sym = sys.intern(sym_elem.text) if sym_elem is not None and sym_elem.text else ''
         
-        waypoints.append({
+        yield {
             'lat': lat,
             'lon': lon,
             'name': name,
@@ -65,10 +74,55 @@ def parse_gpx(gpx_path):
             'comment': cmt,
             'time': time,
             'symbol': sym,
-            'source_file': os.path.basename(gpx_path)
-        })
+            'source_file': source_file
+        }
+        wpt.clear()
+
+
+def parse_gpx(gpx_path):
+    """GPX 파일 파싱하여 waypoint 리스트 반환"""
+    return list(iter_gpx(gpx_path))
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    """두 좌표 사이의 거리 계산 (미터, 라디안 배열 입력, 브로드캐스팅 지원)"""
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _pairs_grid(lat_r, lon_r, distance_threshold):
+    """균일 격자 해싱으로 거리 임계값 이내의 (i, j, 거리) 쌍 검색 (외부 의존성 없음)"""
+    # 임계값 이내의 두 점은 같은 셀 또는 인접 셀에 속하도록 셀 크기 결정
+    # (위도 차는 r/R 이하, 경도 폭은 가장 높은 위도에서 최대)
+    cell_lat = max(distance_threshold, MIN_CELL_M) / EARTH_RADIUS_M
+    cell_lon = 2 * np.arcsin(min(1.0, np.sin(cell_lat / 2) / np.cos(lat_r).min(initial=1.0)))
+    rows = np.floor(lat_r / cell_lat).astype(np.int64).tolist()
+    cols = np.floor(lon_r / cell_lon).astype(np.int64).tolist()
     
-    return waypoints
+    buckets = {}  # {(row, col): [포인트 인덱스]}
+    for idx, cell in enumerate(zip(rows, cols)):
+        buckets.setdefault(cell, []).append(idx)
+    
+    # 주변 9개 셀의 후보만 i < j 쌍으로 수집
+    cand_i, cand_j = [], []
+    for (row, col), members in buckets.items():
+        for dr, dc in GRID_NEIGHBORS:
+            others = buckets.get((row + dr, col + dc))
+            if not others:
+                continue
+            for i in members:
+                for j in others:
+                    if i < j:
+                        cand_i.append(i)
+                        cand_j.append(j)
+    
+    i = np.array(cand_i, dtype=np.int64)
+    j = np.array(cand_j, dtype=np.int64)
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    dist = haversine_array(lat_r[i], lon_r[i], lat_r[j], lon_r[j])
+    within = dist <= distance_threshold
+    return i[within], j[within], dist[within]
 
 
 def find_duplicates(waypoints, distance_threshold=10):
@@ -78,58 +132,63 @@ def find_duplicates(waypoints, distance_threshold=10):
     """
     duplicates = []
     n = len(waypoints)
+    lat_r = np.radians(np.fromiter((w['lat'] for w in waypoints), float, n))
+    lon_r = np.radians(np.fromiter((w['lon'] for w in waypoints), float, n))
     
-    for i in range(n):
-        for j in range(i+1, n):
-            dist = haversine_distance(
-                waypoints[i]['lat'], waypoints[i]['lon'],
-                waypoints[j]['lat'], waypoints[j]['lon']
-            )
-            if dist <= distance_threshold:
-                duplicates.append({
-                    'point1_idx': i,
-                    'point1_name': waypoints[i]['name'] or waypoints[i]['description'],
-                    'point1_source': waypoints[i]['source_file'],
-                    'point1_lat': waypoints[i]['lat'],
-                    'point1_lon': waypoints[i]['lon'],
-                    'point2_idx': j,
-                    'point2_name': waypoints[j]['name'] or waypoints[j]['description'],
-                    'point2_source': waypoints[j]['source_file'],
-                    'point2_lat': waypoints[j]['lat'],
-                    'point2_lon': waypoints[j]['lon'],
-                    'distance_m': round(dist, 2)
-                })
+    pair_i, pair_j, pair_dist = _pairs_grid(lat_r, lon_r, distance_threshold)
+    for i, j, dist in zip(pair_i.tolist(), pair_j.tolist(), pair_dist.tolist()):
+        duplicates.append({
+            'point1_idx': i,
+            'point1_name': waypoints[i]['name'] or waypoints[i]['description'],
+            'point1_source': waypoints[i]['source_file'],
+            'point1_lat': waypoints[i]['lat'],
+            'point1_lon': waypoints[i]['lon'],
+            'point2_idx': j,
+            'point2_name': waypoints[j]['name'] or waypoints[j]['description'],
+            'point2_source': waypoints[j]['source_file'],
+            'point2_lat': waypoints[j]['lat'],
+            'point2_lon': waypoints[j]['lon'],
+            'distance_m': round(dist, 2)
+        })
     
     return duplicates
 
 
 def export_to_csv(waypoints, output_path):
     """waypoint 리스트를 CSV로 내보내기"""
-    df = pd.DataFrame(waypoints)
-    df.to_csv(output_path, index=False, encoding='utf-8-sig')
-    return df
+    fieldnames = list(waypoints[0]) if waypoints else []
+    with open(output_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(waypoints)
 
 
 def export_to_json(waypoints, output_path):
     """waypoint 리스트를 JSON으로 내보내기"""
+    if orjson is not None:
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(waypoints, option=orjson.OPT_INDENT_2))
+        return
+    
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(waypoints, f, ensure_ascii=False, indent=2)
 
 
 def get_statistics(waypoints):
     """waypoint 통계 정보"""
-    df = pd.DataFrame(waypoints)
+    lats = [w['lat'] for w in waypoints]
+    lons = [w['lon'] for w in waypoints]
     
     stats = {
         'total_points': len(waypoints),
-        'by_source': df['source_file'].value_counts().to_dict(),
+        'by_source': dict(Counter(w['source_file'] for w in waypoints).most_common()),
         'lat_range': {
-            'min': df['lat'].min(),
-            'max': df['lat'].max()
+            'min': min(lats),
+            'max': max(lats)
         },
         'lon_range': {
-            'min': df['lon'].min(),
-            'max': df['lon'].max()
+            'min': min(lons),
+            'max': max(lons)
         }
     }
     
@@ -140,21 +199,28 @@ def process_all_gpx(gpx_dir, output_dir, check_duplicates=True, distance_thresho
     """모든 GPX 파일 처리"""
     gpx_files = list(Path(gpx_dir).glob('*.gpx'))
     all_waypoints = []
+    per_file = {}  # 파일별 파싱 결과 (개별 CSV 내보내기에 재사용)
     
     print(f"\n{'='*60}")
     print(f"GPX 파일 처리 시작")
     print(f"{'='*60}")
     
-    for gpx_file in gpx_files:
-        waypoints = parse_gpx(gpx_file)
+    # 입력이 클 때만 파일별로 별도 프로세스에서 파싱 (작으면 프로세스 기동 비용이 더 큼)
+    if len(gpx_files) > 1 and sum(f.stat().st_size for f in gpx_files) >= PARALLEL_MIN_BYTES:
+        with ProcessPoolExecutor() as executor:
+            parsed = list(executor.map(parse_gpx, gpx_files))
+    else:
+        parsed = [parse_gpx(f) for f in gpx_files]
+    
+    for gpx_file, waypoints in zip(gpx_files, parsed):
+        per_file[gpx_file] = waypoints
         all_waypoints.extend(waypoints)
         print(f"  {gpx_file.name}: {len(waypoints)} 포인트")
     
     print(f"\n총 포인트 수: {len(all_waypoints)}")
     
     # 개별 파일별 CSV 내보내기
-    for gpx_file in gpx_files:
-        waypoints = parse_gpx(gpx_file)
+    for gpx_file, waypoints in per_file.items():
         base_name = gpx_file.stem
         export_to_csv(waypoints, os.path.join(output_dir, f'{base_name}.csv'))
     
@@ -177,9 +243,8 @@ def process_all_gpx(gpx_dir, output_dir, check_duplicates=True, distance_thresho
         
         if duplicates:
             print(f"\n발견된 중복: {len(duplicates)}건")
-            dup_df = pd.DataFrame(duplicates)
             dup_path = os.path.join(output_dir, 'duplicates.csv')
-            dup_df.to_csv(dup_path, index=False, encoding='utf-8-sig')
+            export_to_csv(duplicates, dup_path)
             print(f"중복 목록 저장: {dup_path}")
             
             # 상위 10개만 출력